@@ -3,10 +3,10 @@
 # make logical deductions based on the available clues and the current state
 # of the puzzle.
 
-import copy
+import array
 from PIL import Image
 
-from linesolver import LineSolver
+from linesolver import LineContext, line_masks, solve_line
 
 class Hanjie(object):
     """
@@ -25,130 +25,218 @@ class Hanjie(object):
     def __init__(self, row_clues, col_clues):
         """
         Initialise the puzzle with the set of clues defining it. The size of
-        the grid can be inferred from the number of clues provided.
+        the grid can be inferred from the number of clues provided. The clues
+        for each line may be given as any sequence of block lengths, such as a
+        list or a tuple.
         """
         # Create an empty grid for the puzzle - we will let 0 represent an
         # undetermined cell, 1 represent a filled cell and -1 represent a cell
         # which is definitely unfilled.
+        #
+        # The grid is stored row by row in a single array of signed bytes, so
+        # that both rows and columns can be extracted with a single slice.
         self._width = len(col_clues)
         self._height = len(row_clues)
-        self._grid = [[0] * self._width for _ in xrange(self._height)]
+        self._grid = array.array('b', [0]) * (self._width * self._height)
 
-        # Store off the clues for use when solving the puzzle.
-        self._row_clues = copy.deepcopy(row_clues)
-        self._col_clues = copy.deepcopy(col_clues)
+        # Store off the clues for use when solving the puzzle. The clues are
+        # never modified, so an immutable copy is all we need.
+        self._row_clues = tuple(tuple(clues) for clues in row_clues)
+        self._col_clues = tuple(tuple(clues) for clues in col_clues)
 
-        # Keep track of which lines are unchanged since the last time we
-        # tried to deduce information about them
-        self._rows_to_check = [True] * self._height
-        self._cols_to_check = [True] * self._width
+        # Precompute the data about each line which depends only on its clues
+        self._row_contexts = [LineContext(clues, self._width)
+                              for clues in self._row_clues]
+        self._col_contexts = [LineContext(clues, self._height)
+                              for clues in self._col_clues]
 
-    def _check_consistency(self, line, clues):
-        """
-        Given the current state of a single line (row or column) and the clues
-        associated with that line, check that there is no contradiction (that
-        is, that there exists a solution to the line).
+        # Keep track of the lines which have changed since the last time we
+        # tried to deduce information about them, as bitmasks in which bit i
+        # is set if line i has changed
+        self._dirty_rows = (1 << self._height) - 1
+        self._dirty_cols = (1 << self._width) - 1
+
+        # Remember the deductions made from each line, keyed on its clues and
+        # its state, so that identical lines are only ever solved once.
+        self._deduction_cache = {}
 
-        Returns True if the line is consistent and False if inconsistent.
+    def _make_deductions(self, line, context):
         """
-        line_solver = LineSolver(line, clues)
-        return line_solver.has_solution()
+        Given the current state of a single line (row or column) and the
+        LineContext holding the clues associated with that line, firstly,
+        check that no contradiction has arisen, and secondly, make any logical
+        deductions possible from this line alone, filling them in to the line.
 
-    def _make_deductions(self, line, clues):
+        Returns a bitmask of the cells deduced, in which bit i is set if cell
+        i was deduced, if the state of the line is consistent and False if
+        there is an inconsistency.
+
+        Lines with the same clues in the same state always lead to the same
+        deductions, so each distinct line is only solved once.
         """
-        Given the current state of a single line (row or column) and the clues
-        associated with that line, firstly, check that no contradiction has
-        arisen, and secondly, make any logical deductions possible from this
-        line alone.
+        key = (context.clues, line.tobytes())
+        if key in self._deduction_cache:
+            result = self._deduction_cache[key]
+            if result is False:
+                return False
+            filled_line, deductions = result
+            line[:] = filled_line
+            return deductions
+
+        deductions = self._find_deductions(line, context)
+        if deductions is False:
+            self._deduction_cache[key] = False
+        else:
+            self._deduction_cache[key] = (line[:], deductions)
+        return deductions
 
-        Returns a list of deductions if the state of the line is consistent and
-        False if there is an inconsistency.
+    def _find_deductions(self, line, context):
+        """
+        Make the deductions for _make_deductions, without consulting the cache.
         """
-        # First establish consistency of the current state of the line
-        if not self._check_consistency(line, clues):
+        # Before doing any real work, rule out lines which are too short for
+        # the blocks, or which have more cells filled or unfilled than the
+        # clues allow.
+        if (context.min_width > context.length or
+                line.count(1) > context.total or
+                line.count(-1) > context.length - context.total):
             return False
 
-        # Now iterate over each cell which is as yet undetermined, and check
-        # whether the line remains consistent when that cell is filled or
-        # unfilled.
-        deductions = []
-        for i in xrange(len(line)):
-            if line[i] == 0:
-                line[i] = 1
-                if not self._check_consistency(line, clues):
-                    deductions.append((i, -1))
-                line[i] = -1
-                if not self._check_consistency(line, clues):
-                    deductions.append((i, 1))
-                line[i] = 0
+        # If every cell is already determined, there is nothing to deduce, and
+        # the line is consistent exactly when its runs of filled cells match
+        # the clues.
+        undetermined = line.count(0)
+        if undetermined == 0:
+            runs = tuple(len(run) for run in line.tobytes().split(b'\xff')
+                         if run)
+            return 0 if runs == context.clues else False
 
-        return deductions
+        # Now find the cells which take the same value in every solution to
+        # the line. If no cell is determined, these depend only on the clues,
+        # and were found along with the rest of the LineContext. Otherwise,
+        # solve_line finds them, and also tells us if the line has no
+        # solution at all, so there is no need to check its consistency
+        # separately.
+        if undetermined == len(line):
+            must_fill, must_empty = context.blank_fill, context.blank_empty
+        else:
+            forced = solve_line(line, context)
+            if forced is None:
+                return False
+            must_fill, must_empty = forced
+
+        # Deduce the forced value for any cells which are undetermined
+        filled, unfilled = line_masks(line)
+        deduced = (must_fill | must_empty) & ~(filled | unfilled)
 
-    def _single_pass_row(self, index):
+        # Fill in the deduced cells
+        for ix in _bit_indices(deduced):
+            line[ix] = 1 if must_fill >> ix & 1 else -1
+
+        return deduced
+
+    def _row_deductions(self, index):
         """
-        Make a pass over the row with the given index, making any deductions
-        which are possible. Returns True if no contradiction arose and False
-        otherwise.
+        Find the deductions which can be made from the row with the given
+        index, filling them in to a copy of the row rather than the grid.
+        Returns the copy of the row and a bitmask of the cells deduced if the
+        row is consistent and False otherwise.
         """
-        # Extract the line and the clues from the grid
-        line = [self._grid[index][j] for j in xrange(self._width)]
-        clues = self._row_clues[index]
+        start = index * self._width
+        line = self._grid[start:start + self._width]
+        deductions = self._make_deductions(line, self._row_contexts[index])
+        if deductions is False:
+            return False
+        return line, deductions
 
-        # Pull out any deductions that we can make
-        deductions = self._make_deductions(line, clues)
-        if deductions == False:
+    def _col_deductions(self, index):
+        """
+        Find the deductions which can be made from the column with the given
+        index, filling them in to a copy of the column rather than the grid.
+        Returns the copy of the column and a bitmask of the cells deduced if
+        the column is consistent and False otherwise.
+        """
+        line = self._grid[index::self._width]
+        deductions = self._make_deductions(line, self._col_contexts[index])
+        if deductions is False:
             return False
-        
-        # Apply the deductions to the grid and mark any intersecting columns
-        # as requiring another pass
-        for ix, val in deductions:
-            self._grid[index][ix] = val
-            self._cols_to_check[ix] = True
-        self._rows_to_check[index] = False
-        return True
+        return line, deductions
 
-    def _single_pass_col(self, index):
+    def _pass_rows(self):
         """
-        Make a pass over the column with the given index, making any deductions
+        Make a pass over every row which requires one, making any deductions
         which are possible. Returns True if no contradiction arose and False
         otherwise.
+
+        Deductions made from one row never change another row, so we find the
+        deductions for every row first, and only then apply them to the grid.
         """
-        # Extract the line and the clues from the grid
-        line = [self._grid[j][index] for j in xrange(self._height)]
-        clues = self._col_clues[index]
+        indices = _bit_indices(self._dirty_rows)
+        results = list(map(self._row_deductions, indices))
 
-        # Pull out any deductions that we can make
-        deductions = self._make_deductions(line, clues)
-        if deductions == False:
-            return False
-        
-        # Apply the deductions to the grid and mark any intersecting columns
-        # as requiring another pass
-        for ix, val in deductions:
-            self._grid[ix][index] = val
-            self._rows_to_check[ix] = True
-        self._cols_to_check[index] = False
+        # Write each row back to the grid in a single slice assignment and
+        # mark any intersecting columns as requiring another pass. Cell i of a
+        # row lies in column i, so the bitmask of the cells deduced is exactly
+        # the bitmask of the columns affected.
+        grid = self._grid
+        width = self._width
+        dirty_cols = self._dirty_cols
+        for index, result in zip(indices, results):
+            if result is False:
+                return False
+            line, deductions = result
+            if deductions:
+                start = index * width
+                grid[start:start + width] = line
+                dirty_cols |= deductions
+        self._dirty_cols = dirty_cols
+        self._dirty_rows = 0
+        return True
+
+    def _pass_cols(self):
+        """
+        Make a pass over every column which requires one, making any
+        deductions which are possible. Returns True if no contradiction arose
+        and False otherwise.
+
+        Deductions made from one column never change another column, so we
+        find the deductions for every column first, and only then apply them
+        to the grid.
+        """
+        indices = _bit_indices(self._dirty_cols)
+        results = list(map(self._col_deductions, indices))
+
+        # Write each column back to the grid in a single slice assignment and
+        # mark any intersecting rows as requiring another pass
+        grid = self._grid
+        width = self._width
+        dirty_rows = self._dirty_rows
+        for index, result in zip(indices, results):
+            if result is False:
+                return False
+            line, deductions = result
+            if deductions:
+                grid[index::width] = line
+                dirty_rows |= deductions
+        self._dirty_rows = dirty_rows
+        self._dirty_cols = 0
         return True
 
     def _pretty_print(self):
         """
         Display the current state of the grid.
+
+        The grid is already an array of bytes, so we use it directly as the
+        pixel data of a palette image, in which undetermined cells (0) are
+        red, filled cells (1) are black and unfilled cells (-1, stored as 255)
+        are white, and then scale it up.
         """
         sz = 7
-        img = Image.new('RGB', (sz * self._width, sz * self._height), "red")
-        pixels = img.load()
-
-        for i in xrange(self._width):
-            for j in xrange(self._height):
-                if self._grid[j][i] == 1:
-                    for ix in xrange(sz * i, sz * (i + 1)):
-                        for jx in xrange(sz * j, sz * (j + 1)):
-                            pixels[ix, jx] = (0, 0, 0)
-                elif self._grid[j][i] == -1:
-                    for ix in xrange(sz * i, sz * (i + 1)):
-                        for jx in xrange(sz * j, sz * (j + 1)):
-                            pixels[ix, jx] = (255, 255, 255)
-
+        palette = [255, 0, 0] + [0, 0, 0] * 254 + [255, 255, 255]
+        img = Image.frombytes('P', (self._width, self._height),
+                              self._grid.tobytes())
+        img.putpalette(palette)
+        img = img.resize((sz * self._width, sz * self._height), Image.NEAREST)
         img.show()
 
     def solve(self):
@@ -156,25 +244,25 @@ class Hanjie(object):
         Repeatedly make passes over rows and columns until no more deductions
         can be made.
         """
-        while True:
-            made_change = False
-            for i, x in enumerate(self._rows_to_check):
-                if x == True:
-                    if not self._single_pass_row(i):
-                        print "Puzzle is inconsistent"
-                        return
-                    made_change = True
-            for i, x in enumerate(self._cols_to_check):
-                if x == True:
-                    if not self._single_pass_col(i):
-                        print "Puzzle is inconsistent"
-                        return
-                    made_change = True
-            if not made_change:
-                break
+        while self._dirty_rows or self._dirty_cols:
+            if not self._pass_rows() or not self._pass_cols():
+                print("Puzzle is inconsistent")
+                return
 
         self._pretty_print()
 
+def _bit_indices(mask):
+    """
+    Return a list of the indices of the set bits of the given bitmask, in
+    increasing order.
+    """
+    indices = []
+    while mask:
+        bit = mask & -mask
+        indices.append(bit.bit_length() - 1)
+        mask ^= bit
+    return indices
+
 if __name__ == "__main__":
-    hanjie = Hanjie([[22,8,26],[19,16,22],[16,7,12,20],[15,8,6,6,19],[14,9,7,6,19],[13,1,9,6,7,17],[12,1,8,5,8,12],[12,1,8,7,9,10],[11,11,6,9,9],[10,11,6,10,7],[9,13,6,10,5],[7,13,7,13,4],[5,13,3,3,12,7,3],[4,13,5,20,2],[3,14,6,17,2,2],[2,13,6,22,1],[2,17,8,23,1],[1,4,13,5,19,3],[1,6,13,5,20,3],[1,6,14,5,20,1,4],[21,7,18,1,5],[25,7,17,5],[1,21,6,1,17,2,4],[2,20,6,1,19,2,3],[1,22,6,2,19,4,3],[1,20,1,9,21,4,3],[1,21,6,4,19,8],[29,3,1,19,8],[1,23,20,4,9],[22,18,4,7],[19,17,4,4,2],[17,16,4,3,2],[17,2,15,3,5,1],[17,3,14,4,7,2],[2,14,4,13,5,7,2],[2,14,4,11,13,2],[17,5,10,16],[17,4,9,12,4],[17,4,3,9,10,2,2],[17,3,9,18,2,1],[17,4,5,4,16,5],[16,2,3,5,14,6],[16,1,4,2,4,6,14,2,5],[16,8,5,4,4,3,9,2,5],[16,3,9,3,2,2,1,8,7],[16,2,6,4,4,3,1,1,7,7],[8,6,4,3,4,8,4,6,5],[8,6,5,2,4,1,3,5,8,5],[8,6,9,3,1,2,3,12],[8,5,7,2,1,2,3,9],[8,5,7,2,2,4,7],[6,6,4,2,3,9],[7,5,1,2,5,7],[5,5,2,2,13,1],[1,3,5,2,2,12,1],[1,2,6,2,3,2,12,2],[2,9,2,3,3,1,7,2],[4,9,3,3,3,1,3],[5,10,2,4,2,1,4],[5,9,3,5,2,1,1,5],[6,11,3,2,5,2,6],[6,5,3,10,6,9],[7,2,13,20],[8,10,2,1,1,18],[9,10,1,1,1,18],[11,10,1,2,1,18],[14,9,10,1,2,17],[19,5,7,3,2,4,17],[21,10,2,1,4,16],[22,5,9,3,15],[23,5,7,3,14],[23,5,1,2,13],[23,13,3,12],[23,6,3,11],[22,2,4,2,3,6],[21,4,3,3,2,4],[20,5,4,3,1,1],[19,3,3,4,2,2],[17,3,5,10,1],[16,4,4,2,6,2],[15,6,5,2,2],[14,6,7,4,2],[13,8,5,2,4,2],[11,9,7,2,2],[10,11,7,2,2],[9,12,5,4,2],[12,8,5,5,3],[9,10,5,2,4,5],[6,13,4,2,17],[5,6,3,2,1,2,2,13],[3,4,4,1,1,2,2],[1,4,5,2,1,2,3],[3,6,1,2,2,2],[3,6,2,2,1,3],[1,7,2,2,2,3]],[[20,10,38,2],[17,14,35,1],[15,17,34,2],[14,7,2,15,33,1],[13,3,1,23,32,2],[12,2,29,29,1,1],[12,34,26,2,1],[11,36,25,2,1],[11,36,24,2,2],[10,28,7,20,1,2,2],[9,30,1,7,19,1,2,3],[8,32,8,17,2,2,3],[6,3,32,4,17,1,2,2],[5,2,41,16,2,3,3],[4,3,43,14,2,2,2],[3,50,13,6,3],[2,30,15,12,6,2],[2,26,5,12,11,10],[2,25,6,8,8,11,9,1],[1,25,7,3,9,4,9,9,2],[1,25,8,2,7,5,1,8,9,3],[1,1,23,7,1,2,7,6,6,12],[1,24,5,4,5,6,4,11,1],[1,24,3,3,6,6,3],[26,8,6,5,9],[22,3,5,6,4,6,1],[17,2,2,2,1,1,1,8,3,14],[12,2,1,1,2,2,11,3,14],[10,1,1,2,4,14,3,10],[7,1,2,5,18,11],[5,3,16,6,6,11],[5,3,14,6,1,5,2,2,4],[3,1,1,3,8,2,6,2,2,3],[2,1,2,3,7,3,1,4,6,2,2,4],[2,19,3,4,7,2,2,1,2],[1,21,2,2,4,2,3,1,1,2,3],[1,22,1,2,3,2,1,3,2,2,5],[12,14,3,1,2,2,1,2,2,2,4],[12,3,5,2,5,2,2,2,1,2,1,3,2],[10,2,2,2,2,2,5,2,2,2,1,2,1,2],[6,1,2,3,4,2,2,2,1,2,2,2,2],[5,1,3,2,1,3,3,3,1,2,2],[5,3,2,2,2,3,2,1,2],[3,4,7,2,3,2,2,2],[3,2,6,2,1,2,1,1,2,2],[3,2,6,2,3,2,1,1,2],[4,1,1,2,10,1,2,2,1,2,2],[8,2,1,12,1,2,2,2,1,2],[13,19,2,3,2,2],[33,2,2,2,2],[34,1,2,1,2],[34,1,1,2,1],[34,1,2],[34,2,1],[1,34,2,1],[1,32,3,1],[1,32,4,2],[1,34,5,1],[2,38,3,2,2],[2,16,8,14,2,2],[3,16,5,5,3,7,7,2],[5,26,4,3,5,3,2],[5,32,3,5,5,2],[6,20,12,3,5,7,2],[6,19,12,1,3,4,8,2],[6,2,6,2,14,7,9,3],[6,2,5,16,7,9,3],[6,4,2,1,17,6,10,2],[7,3,1,7,25,11,1],[7,2,1,34,13],[8,3,1,33,12],[9,6,17,7,13],[9,6,4,6,4,4,13],[10,13,1,9,13],[10,13,6,1,7,15],[11,8,19,16],[12,2,10,18],[13,2,8,19],[15,8,21],[17,4,24]])
+    hanjie = Hanjie(((22,8,26),(19,16,22),(16,7,12,20),(15,8,6,6,19),(14,9,7,6,19),(13,1,9,6,7,17),(12,1,8,5,8,12),(12,1,8,7,9,10),(11,11,6,9,9),(10,11,6,10,7),(9,13,6,10,5),(7,13,7,13,4),(5,13,3,3,12,7,3),(4,13,5,20,2),(3,14,6,17,2,2),(2,13,6,22,1),(2,17,8,23,1),(1,4,13,5,19,3),(1,6,13,5,20,3),(1,6,14,5,20,1,4),(21,7,18,1,5),(25,7,17,5),(1,21,6,1,17,2,4),(2,20,6,1,19,2,3),(1,22,6,2,19,4,3),(1,20,1,9,21,4,3),(1,21,6,4,19,8),(29,3,1,19,8),(1,23,20,4,9),(22,18,4,7),(19,17,4,4,2),(17,16,4,3,2),(17,2,15,3,5,1),(17,3,14,4,7,2),(2,14,4,13,5,7,2),(2,14,4,11,13,2),(17,5,10,16),(17,4,9,12,4),(17,4,3,9,10,2,2),(17,3,9,18,2,1),(17,4,5,4,16,5),(16,2,3,5,14,6),(16,1,4,2,4,6,14,2,5),(16,8,5,4,4,3,9,2,5),(16,3,9,3,2,2,1,8,7),(16,2,6,4,4,3,1,1,7,7),(8,6,4,3,4,8,4,6,5),(8,6,5,2,4,1,3,5,8,5),(8,6,9,3,1,2,3,12),(8,5,7,2,1,2,3,9),(8,5,7,2,2,4,7),(6,6,4,2,3,9),(7,5,1,2,5,7),(5,5,2,2,13,1),(1,3,5,2,2,12,1),(1,2,6,2,3,2,12,2),(2,9,2,3,3,1,7,2),(4,9,3,3,3,1,3),(5,10,2,4,2,1,4),(5,9,3,5,2,1,1,5),(6,11,3,2,5,2,6),(6,5,3,10,6,9),(7,2,13,20),(8,10,2,1,1,18),(9,10,1,1,1,18),(11,10,1,2,1,18),(14,9,10,1,2,17),(19,5,7,3,2,4,17),(21,10,2,1,4,16),(22,5,9,3,15),(23,5,7,3,14),(23,5,1,2,13),(23,13,3,12),(23,6,3,11),(22,2,4,2,3,6),(21,4,3,3,2,4),(20,5,4,3,1,1),(19,3,3,4,2,2),(17,3,5,10,1),(16,4,4,2,6,2),(15,6,5,2,2),(14,6,7,4,2),(13,8,5,2,4,2),(11,9,7,2,2),(10,11,7,2,2),(9,12,5,4,2),(12,8,5,5,3),(9,10,5,2,4,5),(6,13,4,2,17),(5,6,3,2,1,2,2,13),(3,4,4,1,1,2,2),(1,4,5,2,1,2,3),(3,6,1,2,2,2),(3,6,2,2,1,3),(1,7,2,2,2,3)),((20,10,38,2),(17,14,35,1),(15,17,34,2),(14,7,2,15,33,1),(13,3,1,23,32,2),(12,2,29,29,1,1),(12,34,26,2,1),(11,36,25,2,1),(11,36,24,2,2),(10,28,7,20,1,2,2),(9,30,1,7,19,1,2,3),(8,32,8,17,2,2,3),(6,3,32,4,17,1,2,2),(5,2,41,16,2,3,3),(4,3,43,14,2,2,2),(3,50,13,6,3),(2,30,15,12,6,2),(2,26,5,12,11,10),(2,25,6,8,8,11,9,1),(1,25,7,3,9,4,9,9,2),(1,25,8,2,7,5,1,8,9,3),(1,1,23,7,1,2,7,6,6,12),(1,24,5,4,5,6,4,11,1),(1,24,3,3,6,6,3),(26,8,6,5,9),(22,3,5,6,4,6,1),(17,2,2,2,1,1,1,8,3,14),(12,2,1,1,2,2,11,3,14),(10,1,1,2,4,14,3,10),(7,1,2,5,18,11),(5,3,16,6,6,11),(5,3,14,6,1,5,2,2,4),(3,1,1,3,8,2,6,2,2,3),(2,1,2,3,7,3,1,4,6,2,2,4),(2,19,3,4,7,2,2,1,2),(1,21,2,2,4,2,3,1,1,2,3),(1,22,1,2,3,2,1,3,2,2,5),(12,14,3,1,2,2,1,2,2,2,4),(12,3,5,2,5,2,2,2,1,2,1,3,2),(10,2,2,2,2,2,5,2,2,2,1,2,1,2),(6,1,2,3,4,2,2,2,1,2,2,2,2),(5,1,3,2,1,3,3,3,1,2,2),(5,3,2,2,2,3,2,1,2),(3,4,7,2,3,2,2,2),(3,2,6,2,1,2,1,1,2,2),(3,2,6,2,3,2,1,1,2),(4,1,1,2,10,1,2,2,1,2,2),(8,2,1,12,1,2,2,2,1,2),(13,19,2,3,2,2),(33,2,2,2,2),(34,1,2,1,2),(34,1,1,2,1),(34,1,2),(34,2,1),(1,34,2,1),(1,32,3,1),(1,32,4,2),(1,34,5,1),(2,38,3,2,2),(2,16,8,14,2,2),(3,16,5,5,3,7,7,2),(5,26,4,3,5,3,2),(5,32,3,5,5,2),(6,20,12,3,5,7,2),(6,19,12,1,3,4,8,2),(6,2,6,2,14,7,9,3),(6,2,5,16,7,9,3),(6,4,2,1,17,6,10,2),(7,3,1,7,25,11,1),(7,2,1,34,13),(8,3,1,33,12),(9,6,17,7,13),(9,6,4,6,4,4,13),(10,13,1,9,13),(10,13,6,1,7,15),(11,8,19,16),(12,2,10,18),(13,2,8,19),(15,8,21),(17,4,24)))
     hanjie.solve()
@@ -1,155 +1,211 @@
 # linesolver.py
-# This module contains a class which attempts to verify the consistency of a
-# single line (row or column) of a Hanjie puzzle, given the cells already
-# filled in.
+# This module contains a class which holds the data about a single line (row or
+# column) of a Hanjie puzzle which depends only on its clues, and a function
+# which, given the cells already filled in, finds the cells whose values are
+# forced, or determines that the line has no solution.
 
-import bisect
-import copy
-
-class LineSolver(object):
+class LineContext(object):
     """
-    This class determines a single solution (if it exists) to a single line
-    of a Hanjie puzzle, which is consistent with any cells which have already
-    been filled in.
-
-    It attempts to find a solution by placing blocks left-to-right and then
-    applying a depth-first search to find solutions to the whole line.
+    This class holds the data about a single line of a Hanjie puzzle which
+    depends only on its clues and its length, and not on the cells which have
+    been filled in, so that it can be computed once and reused every time the
+    line is solved.
     """
-    def __init__(self, line, clues):
-        """
-        Initialise some data specific to the line being solved.
-        """
-        # Store the current state of the line and the clues associated with it.
-        # For convenience, we actually append an extra cell to the end of the
-        # line, and set this cell to empty.
-        self._line = copy.deepcopy(line) + [-1]
-        self._clues = copy.deepcopy(clues)
-        self._length = len(self._line)
-
-        # Additionally, some nodes on the search tree can be reached in more
-        # than one way. Here, we keep track of the positions that have been
-        # seen before, so as not to repeat work unnecessarily.
-        self._seen_positions = set()
-
-        # Calculate suffix-sums for the lengths of blocks required
-        self._length_suffix = [sum([x + 1 for x in self._clues])]
-        for x in self._clues:
-            self._length_suffix.append(self._length_suffix[-1] - (x + 1))
-
-        # Store the positions of the shaded cells in the line
-        self._shaded_pos = [-1]
-        for i, x in enumerate(self._line):
-            if x == 1:
-                self._shaded_pos.append(i)
-
-    def _root(self):
-        """
-        Each node in the tree consists of a pair of numbers - the index of the
-        first cell not yet reached by a block that we have attempted to place,
-        and the index of the first clue corresponding to a block that we have
-        not yet placed.
-
-        Initially, at the root of the tree, these numbers are both 0.
-        """
-        return (0, 0)
-
-    def _reject(self, node):
+    def __init__(self, clues, length):
         """
-        We should reject this node if there is insufficient space left in the 
-        line to place the remaining blocks.
-
-        If this situation ever arises, then due to the ordering of nodes in the
-        tree (we always place in the leftmost available position first) this
-        indicates that the entire row is inconsistent, and this should be
-        raised all the way to the top of the tree.
-        """
-        # Extract the first unused block and the position in the line from
-        # the node
-        line_pos, first_block = node
-
-        # Check that the space required for the remaining blocks is small
-        # enough to fit in the remaining space in the line.
-        if self._length_suffix[first_block] > self._length - line_pos:
-            return True
-        else:
-            return False
-
-    def _accept(self, node):
-        """
-        We should accept this node if all blocks have been placed successfully
-        and there are no shaded blocks past the end of the last block.
-        """
-        line_pos, first_block = node
-        if first_block == len(self._clues) and line_pos > self._shaded_pos[-1]:
-            return True
-        else:
-            return False
-
-    def _is_allowed(self, block_size, end_pos):
-        """
-        Determine if it is possible to place a block of the given size in the
-        cells immediately preceeding the given end position.
+        Precompute the data for a line of the given length with the given
+        clues.
         """
-        return (self._line[end_pos] != 1 and 
-                all(self._line[i] != -1 
-                    for i in xrange(end_pos - block_size, end_pos)))
+        # A clue of 0 is the usual way of writing that a line has no blocks
+        # at all, so blocks of no length are dropped rather than placed.
+        self.clues = tuple(clue for clue in clues if clue)
+        self.reversed_clues = self.clues[::-1]
+        self.length = length
+
+        # The number of cells which must be filled, the fewest cells the
+        # blocks can occupy including the gaps between them, and the number
+        # of cells left over.
+        self.total = sum(self.clues)
+        self.min_width = self.total + max(len(self.clues) - 1, 0)
+        self.slack = length - self.min_width
+
+        # Bitmasks of the line with an extra unfilled cell at each end, and of
+        # just the cells of the line itself.
+        self.width = length + 2
+        self.all_cells = (1 << self.width) - 1
+        self.cells = ((1 << length) - 1) << 1
+        self.ends = 1 | (1 << (self.width - 1))
+
+        # Bitmasks of the cells which are filled (respectively unfilled) in
+        # every solution to the line when none of its cells are determined.
+        # These can be found directly: the kth block may start anywhere from
+        # its leftmost position to slack cells further on, so it always covers
+        # the cells between its rightmost start and its leftmost end, and any
+        # cell which no block can reach is always unfilled.
+        self.blank_fill = 0
+        self.blank_empty = 0
+        if self.slack >= 0:
+            reachable = 0
+            start = 0
+            for block_size in self.clues:
+                if block_size > self.slack:
+                    self.blank_fill |= (((1 << (block_size - self.slack)) - 1)
+                                        << (start + self.slack))
+                reachable |= ((1 << (block_size + self.slack)) - 1) << start
+                start += block_size + 1
+            self.blank_empty = ((1 << length) - 1) & ~reachable
+
+# Translation tables which map each cell of a line, stored as a signed byte,
+# to a binary digit marking whether the cell is filled or unfilled.
+_FILLED_DIGITS = b''.join(b'1' if i == 1 else b'0' for i in range(256))
+_UNFILLED_DIGITS = b''.join(b'1' if i == 255 else b'0' for i in range(256))
+
+def _line_digits(line):
+    """
+    Translate a line, given as an array of signed bytes, into a pair of
+    strings of binary digits, marking the cells which are filled and those
+    which are unfilled respectively.
+    """
+    cells = line.tobytes()
+    return cells.translate(_FILLED_DIGITS), cells.translate(_UNFILLED_DIGITS)
 
-    def _children(self, node):
-        """
-        The only children worth considering are:
+def line_masks(line):
+    """
+    Pack a line, given as an array of signed bytes, into a pair of bitmasks
+    (filled, unfilled), where bit i is set if cell i is filled (respectively
+    unfilled).
+    """
+    # The first digit parsed becomes the highest bit, so the digits are
+    # reversed. The leading zero allows for an empty line.
+    filled_digits, unfilled_digits = _line_digits(line)
+    return (int(b'0' + filled_digits[::-1], 2),
+            int(b'0' + unfilled_digits[::-1], 2))
 
-        0) The leftmost position for the next block.
-        1) The leftmost position for the next block providing that it overlaps
-           with one of the coming shaded blocks.
-        2) The leftmost position for the next block providing that it overlaps
-           with two of the coming shaded blocks.
+def _smear_down(mask, size):
+    """
+    Return the bitmask in which bit i is set if any of bits i to i + size - 1
+    of the given bitmask are set.
+    """
+    span = 1
+    while span < size:
+        step = min(span, size - span)
+        mask |= mask >> step
+        span += step
+    return mask
+
+def _smear_up(mask, size):
+    """
+    Return the bitmask in which bit i is set if any of bits i - size + 1 to i
+    of the given bitmask are set.
+    """
+    span = 1
+    while span < size:
+        step = min(span, size - span)
+        mask |= mask << step
+        span += step
+    return mask
+
+def _reverse(mask, width):
+    """
+    Reverse the order of the lowest width bits of the given bitmask.
+    """
+    return int(format(mask, '0%db' % width)[::-1], 2)
 
-        etc. It is easy to iterate over these possible placements.
-        """
-        # Extract the first unused block and the position in the line from the
-        # node.
-        line_pos, first_block = node
-        
-        # If we've used all the blocks, then there are no children
-        if first_block == len(self._clues):
-            return
-        block_size = self._clues[first_block]
-
-        # Find the position of the rightmost cell we can end at without
-        # having skipped over any shaded cells.
-        first_shaded_ix = bisect.bisect_left(self._shaded_pos, line_pos)
-        if first_shaded_ix < len(self._shaded_pos):
-            first_shaded_cell = self._shaded_pos[first_shaded_ix]
-        else:
-            first_shaded_cell = self._length
-        last_cell = min(self._length - 1, first_shaded_cell + block_size)
-
-        # Iterate over the coming shaded blocks to find the possible placements
-        block_end = line_pos + block_size
-        while block_end <= last_cell:
-            while not self._is_allowed(block_size, block_end):
-                block_end += 1
-                if block_end > last_cell: return
-            yield(block_end + 1, first_block + 1)
-            while self._line[block_end] != 1:
-                block_end += 1
-                if block_end > last_cell: return
-            block_end += 1
-
-    def has_solution(self):
-        """
-        Iteratively search until a solution is found.
-        """
-        stack = [self._root()]
-        while stack:
-            node = stack.pop()
-            if self._reject(node): return False
-            if self._accept(node): return True
-
-            children = []
-            for next_node in self._children(node):
-                children.append(next_node)
-                for child in reversed(children):
-                    stack.append(child)
-
-        return False
+def _placements(unfilled, can_empty, clues):
+    """
+    Given bitmasks of the cells of a line which are unfilled and of those
+    which may be left unfilled, and the clues for the line, find where each
+    successive block may end.
+
+    Returns a list whose kth entry is a bitmask of the positions p for which
+    the first k blocks can be placed in the cells before p, with cell p - 1
+    left unfilled. The line is expected to begin with an unfilled cell, so
+    position 1 is where we start from.
+    """
+    # From each reachable position we can step forward past any cell which
+    # may be left unfilled. Adding the bitmask of such cells to the positions
+    # within it carries each position along to the end of its run of cells.
+    positions = 2
+    positions |= ((positions & can_empty) + can_empty) ^ can_empty
+    placements = [positions]
+    for block_size in clues:
+        # A block may start at any reachable position provided that it covers
+        # no unfilled cells and the cell after it may be left unfilled.
+        starts = (positions & ~_smear_down(unfilled, block_size) &
+                  (can_empty >> block_size))
+        positions = starts << (block_size + 1)
+        positions |= ((positions & can_empty) + can_empty) ^ can_empty
+        placements.append(positions)
+    return placements
+
+def solve_line(line, context):
+    """
+    Determine the cells which take the same value in every solution to a
+    line, without having to test each cell individually.
+
+    The line is represented by bitmasks, with bit i standing for cell i, so
+    that each step of the search acts on every position in the line at once.
+    For convenience, an extra unfilled cell is added at each end of the line.
+    Working forward, we find the positions each block can be placed up to.
+    Working backward (by reversing the line), we find the positions each
+    block can be placed from. A cell may be left unfilled if some forward
+    and backward positions meet at it, and may be filled if some block can
+    be placed over it between a forward and a backward position.
+
+    The line is given as an array of signed bytes, and the clue-derived data
+    for the line is taken from the given LineContext.
+
+    Returns a pair of bitmasks (must_fill, must_empty), where bit i is set if
+    cell i is filled (respectively unfilled) in every solution, or None if
+    the line has no solution at all.
+    """
+    clues = context.clues
+    width = context.width
+    all_cells = context.all_cells
+
+    # Pack the line into bitmasks, both forward and reversed. Rather than
+    # looping over the cells, we translate the bytes of the line into strings
+    # of binary digits and parse those, so that the work is done in C. The
+    # first digit parsed becomes the highest bit, and the trailing zero leaves
+    # room for the extra cell at the start of the line.
+    filled_digits, unfilled_digits = _line_digits(line)
+    filled = int(filled_digits[::-1] + b'0', 2)
+    rev_filled = int(filled_digits + b'0', 2)
+    unfilled = int(unfilled_digits[::-1] + b'0', 2) | context.ends
+    rev_unfilled = int(unfilled_digits + b'0', 2) | context.ends
+
+    # If all of the blocks cannot be placed before the end of the line, then
+    # there is no solution.
+    left = _placements(unfilled, all_cells & ~filled, clues)
+    if not left[-1] >> width & 1:
+        return None
+
+    # Position p in the reversed line corresponds to position width - p in
+    # the line, so that right[k] is a bitmask of the positions p for which
+    # the blocks from the kth onwards can be placed in the cells from p
+    # onwards, with cell p left unfilled.
+    right = [_reverse(positions, width + 1)
+             for positions in reversed(_placements(rev_unfilled,
+                                                   all_cells & ~rev_filled,
+                                                   context.reversed_clues))]
+
+    # A cell may be left unfilled if the first k blocks can be placed before
+    # it and the rest after it.
+    empty_possible = 0
+    for k in range(len(clues) + 1):
+        empty_possible |= (left[k] >> 1) & right[k]
+
+    # A cell may be filled if the kth block can be placed over it, with the
+    # first k blocks placed before it and the rest after it.
+    fill_possible = 0
+    for k in range(len(clues)):
+        block_size = clues[k]
+        starts = (left[k] & ~_smear_down(unfilled, block_size) &
+                  (right[k + 1] >> block_size))
+        fill_possible |= _smear_up(starts, block_size)
+
+    # Cells which can never be unfilled must be filled, and vice versa.
+    cells = context.cells
+    must_fill = (cells & ~empty_possible) >> 1
+    must_empty = (cells & ~fill_possible) >> 1
+    return must_fill, must_empty
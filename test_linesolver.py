@@ -0,0 +1,149 @@
+# test_linesolver.py
+# This module checks the line solving against brute force. For every line of
+# up to a small length, every list of clues and every state of the line, the
+# cells found to be forced are compared with those which take the same value
+# in every solution found by enumerating all fillings of the line. It can be
+# run directly, or with pytest.
+
+import array
+import itertools
+
+from hanjie import Hanjie
+from linesolver import LineContext, solve_line
+
+# The longest line to check. Every state of every line is tried, so the work
+# grows as 6 ** MAX_LENGTH.
+MAX_LENGTH = 8
+
+def _runs(filled, length):
+    """
+    Return the lengths of the runs of filled cells in a filling of a line,
+    given as a bitmask, as a tuple.
+    """
+    runs = []
+    run = 0
+    for i in range(length):
+        if filled >> i & 1:
+            run += 1
+        elif run:
+            runs.append(run)
+            run = 0
+    if run:
+        runs.append(run)
+    return tuple(runs)
+
+def _solutions(length):
+    """
+    Return a dictionary mapping each list of clues, as a tuple, to a list of
+    the fillings of a line of the given length which satisfy it.
+    """
+    solutions = {}
+    for filled in range(1 << length):
+        solutions.setdefault(_runs(filled, length), []).append(filled)
+    return solutions
+
+def _clue_lists(length):
+    """
+    Return the lists of clues to check for a line of the given length: every
+    list of clues whose blocks fit in one more cell than the line has, so
+    that some have no solution, along with the list [0] for an empty line
+    and each list with a clue of 0 appended.
+    """
+    def fitting(space):
+        yield ()
+        for clue in range(1, space + 1):
+            for rest in fitting(space - clue - 1):
+                yield (clue,) + rest
+    clue_lists = set(fitting(length + 1))
+    clue_lists.update([clues + (0,) for clues in clue_lists])
+    clue_lists.add((0,))
+    return sorted(clue_lists)
+
+def _lines(length):
+    """
+    Yield every state of a line of the given length, as an array of signed
+    bytes together with bitmasks of its filled and unfilled cells.
+    """
+    for cells in itertools.product((0, 1, -1), repeat=length):
+        filled = sum(1 << i for i, x in enumerate(cells) if x == 1)
+        unfilled = sum(1 << i for i, x in enumerate(cells) if x == -1)
+        yield array.array('b', cells), filled, unfilled
+
+def _forced(solutions, filled, unfilled, length):
+    """
+    Given the fillings which satisfy the clues of a line and bitmasks of the
+    cells of the line which are filled and unfilled, return the bitmasks
+    (must_fill, must_empty) of the cells which take the same value in every
+    filling which agrees with the line, or None if there is none.
+    """
+    must_fill = must_empty = (1 << length) - 1
+    found = False
+    for solution in solutions:
+        if solution & unfilled or filled & ~solution:
+            continue
+        found = True
+        must_fill &= solution
+        must_empty &= ~solution
+    if not found:
+        return None
+    return must_fill, must_empty
+
+def test_solve_line():
+    """
+    Check solve_line, and the masks used in its place for blank lines,
+    against brute force.
+    """
+    for length in range(MAX_LENGTH + 1):
+        solutions = _solutions(length)
+        for clues in _clue_lists(length):
+            context = LineContext(clues, length)
+            positive = tuple(clue for clue in clues if clue)
+            for line, filled, unfilled in _lines(length):
+                expected = _forced(solutions.get(positive, []),
+                                   filled, unfilled, length)
+                assert solve_line(line, context) == expected, (line, clues)
+                if not filled and not unfilled and expected is not None:
+                    assert (context.blank_fill,
+                            context.blank_empty) == expected, (length, clues)
+
+def test_make_deductions():
+    """
+    Check the deductions made by Hanjie from a single line, including those
+    which bypass solve_line, against brute force.
+    """
+    for length in range(MAX_LENGTH + 1):
+        solutions = _solutions(length)
+        hanjie = Hanjie([()], [()] * length)
+        for clues in _clue_lists(length):
+            context = LineContext(clues, length)
+            positive = tuple(clue for clue in clues if clue)
+            for line, filled, unfilled in _lines(length):
+                expected = _forced(solutions.get(positive, []),
+                                   filled, unfilled, length)
+                deductions = hanjie._make_deductions(line, context)
+                if expected is None:
+                    assert deductions is False, (line, clues)
+                    continue
+                must_fill, must_empty = expected
+                undetermined = ((1 << length) - 1) & ~(filled | unfilled)
+                assert deductions == (must_fill | must_empty) & undetermined
+                for i in range(length):
+                    if must_fill >> i & 1:
+                        assert line[i] == 1, (line, clues)
+                    elif must_empty >> i & 1:
+                        assert line[i] == -1, (line, clues)
+
+def test_zero_clues():
+    """
+    Check that a puzzle using the clue [0] for empty lines is solved.
+    """
+    hanjie = Hanjie([[1], [0]], [[1], [0]])
+    hanjie._pretty_print = lambda: None
+    hanjie.solve()
+    assert list(hanjie._grid) == [1, -1, -1, -1]
+
+if __name__ == "__main__":
+    test_solve_line()
+    test_make_deductions()
+    test_zero_clues()
+    print("All checks passed")